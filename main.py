@@ -1,13 +1,16 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Header
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from datetime import datetime
 import sqlite3
 import asyncio
+import threading
+import time
 import httpx
 import os
-from typing import Optional
+import secrets
+from typing import Awaitable, Callable, Dict, Optional
 import logging
 from dotenv import load_dotenv
 
@@ -23,26 +26,193 @@ app = FastAPI(title="Telegram Reminder Bot")
 # Database setup
 DB_NAME = "reminders.db"
 
+# Shared connection, opened by init_db() on startup and reused by every request
+DB_CONN: Optional[sqlite3.Connection] = None
+DB_LOCK = threading.Lock()
+
+# Sent reminders are archived after 30 days, checked once a day, to keep the
+# live table and its indexes small
+REMINDER_RETENTION_SECONDS = 30 * 24 * 60 * 60
+ARCHIVE_INTERVAL_SECONDS = 24 * 60 * 60
+
+# Runtime SQL, named once and shared by the helpers that run it
+SQL_INSERT = """
+    INSERT INTO reminders (user_id, chat_id, message, reminder_date, created_at, sent)
+    VALUES (?, ?, ?, ?, ?, 0)
+"""
+# Single inserts get their ID back from the statement itself; lastrowid is not
+# safe to read back on a connection shared between threads
+SQL_INSERT_RETURNING = """
+    INSERT INTO reminders (user_id, chat_id, message, reminder_date, created_at, sent)
+    VALUES (?, ?, ?, ?, ?, 0)
+    RETURNING id
+"""
+SQL_DUE = """
+    SELECT id, user_id, chat_id, message, reminder_date
+    FROM reminders
+    WHERE sent = 0 AND reminder_date <= ?
+"""
+SQL_MARK = "UPDATE reminders SET sent = 1 WHERE id = ?"
+SQL_NEXT_DUE = "SELECT MIN(reminder_date) FROM reminders WHERE sent = 0"
+SQL_USER_REMINDERS = """
+    SELECT id, message, reminder_date, created_at, sent
+    FROM reminders
+    WHERE user_id = ?
+    ORDER BY reminder_date DESC
+"""
+SQL_ARCHIVE_COPY = """
+    INSERT OR REPLACE INTO reminders_archive
+    SELECT * FROM reminders WHERE sent = 1 AND reminder_date < ?
+"""
+SQL_ARCHIVE_DELETE = "DELETE FROM reminders WHERE sent = 1 AND reminder_date < ?"
+
+# Reminders that were delivered but could not yet be marked as sent; they are
+# skipped when sending and retried every MARK_RETRY_SECONDS
+unmarked_ids: set = set()
+MARK_RETRY_SECONDS = 30
+next_mark_retry = 0.0
+
+# Reminders Telegram did not accept stay unsent and are retried after this pause
+SEND_RETRY_SECONDS = 30
+next_send_retry = 0.0
+
 def init_db():
     """Initialize the database with reminders table"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
+    global DB_CONN
+    DB_CONN = sqlite3.connect(DB_NAME, check_same_thread=False, isolation_level=None)
+    cursor = DB_CONN.cursor()
+    # WAL lets readers run alongside the scheduler's writes; NORMAL sync skips
+    # the per-commit fsync that rollback-journal mode requires
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-20000")
+    create_table = """
         CREATE TABLE IF NOT EXISTS reminders (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id TEXT NOT NULL,
             chat_id TEXT NOT NULL,
             message TEXT NOT NULL,
-            reminder_date TEXT NOT NULL,
-            created_at TEXT NOT NULL,
+            reminder_date INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            sent INTEGER DEFAULT 0
+        )
+    """
+    # Migrate databases created when dates were stored as TEXT to unix timestamps
+    columns = {row[1]: row[2] for row in cursor.execute("PRAGMA table_info(reminders)")}
+    if columns.get("reminder_date") == "TEXT":
+        cursor.executescript(f"""
+            BEGIN;
+            ALTER TABLE reminders RENAME TO reminders_old;
+            {create_table};
+            INSERT INTO reminders (id, user_id, chat_id, message, reminder_date, created_at, sent)
+            SELECT id, user_id, chat_id, message,
+                   CAST(strftime('%s', reminder_date, 'utc') AS INTEGER),
+                   CAST(strftime('%s', created_at, 'utc') AS INTEGER),
+                   sent
+            FROM reminders_old;
+            DROP TABLE reminders_old;
+            COMMIT;
+        """)
+        logger.info("Migrated reminder dates to unix timestamps")
+    cursor.execute(create_table)
+    # Sent reminders older than REMINDER_RETENTION_SECONDS are moved here
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reminders_archive (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            chat_id TEXT NOT NULL,
+            message TEXT NOT NULL,
+            reminder_date INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
             sent INTEGER DEFAULT 0
         )
     """)
-    conn.commit()
-    conn.close()
+    # Partial index for the scheduler's due-reminder lookups
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_due ON reminders(sent, reminder_date) WHERE sent = 0")
+    # Serves get_user_reminders, including its ORDER BY
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user ON reminders(user_id, reminder_date DESC)")
     logger.info("Database initialized")
 
-init_db()
+def format_reminder_date(reminder_ts: int) -> str:
+    """Format a unix timestamp as YYYY-MM-DD HH:MM without strftime's locale handling"""
+    return datetime.fromtimestamp(reminder_ts).isoformat(sep=" ", timespec="minutes")
+
+# Blocking database helpers; call them via asyncio.to_thread() so a slow
+# checkpoint or lock wait never stalls the event loop
+def _db_insert_reminder(user_id: str, chat_id: str, message: str, reminder_ts: int) -> int:
+    """Insert a reminder and return its ID"""
+    with DB_LOCK:
+        return DB_CONN.execute(
+            SQL_INSERT_RETURNING,
+            (user_id, chat_id, message, reminder_ts, int(time.time()))
+        ).fetchone()[0]
+
+def _db_insert_reminders(rows: list) -> None:
+    """Insert (user_id, chat_id, message, reminder_ts) rows in a single transaction"""
+    created_at = int(time.time())
+    with DB_LOCK:
+        DB_CONN.execute("BEGIN")
+        try:
+            DB_CONN.executemany(SQL_INSERT, [(*row, created_at) for row in rows])
+            DB_CONN.execute("COMMIT")
+        except Exception:
+            DB_CONN.execute("ROLLBACK")
+            raise
+
+def _db_fetch_due(now: int) -> list:
+    """Fetch unsent reminders due at or before the given timestamp"""
+    with DB_LOCK:
+        return DB_CONN.execute(SQL_DUE, (now,)).fetchall()
+
+def _db_mark_sent(reminder_ids: list) -> None:
+    """Mark reminders as sent in a single transaction"""
+    with DB_LOCK:
+        DB_CONN.execute("BEGIN")
+        try:
+            DB_CONN.executemany(SQL_MARK, [(reminder_id,) for reminder_id in reminder_ids])
+            DB_CONN.execute("COMMIT")
+        except Exception:
+            DB_CONN.execute("ROLLBACK")
+            raise
+
+def _db_archive_sent(cutoff: int) -> int:
+    """Move sent reminders due before the cutoff into reminders_archive"""
+    with DB_LOCK:
+        DB_CONN.execute("BEGIN")
+        try:
+            DB_CONN.execute(SQL_ARCHIVE_COPY, (cutoff,))
+            archived = DB_CONN.execute(SQL_ARCHIVE_DELETE, (cutoff,)).rowcount
+            DB_CONN.execute("COMMIT")
+        except Exception:
+            DB_CONN.execute("ROLLBACK")
+            raise
+    return archived
+
+def _db_next_due() -> Optional[int]:
+    """Return the timestamp of the earliest unsent reminder, if any"""
+    with DB_LOCK:
+        return DB_CONN.execute(SQL_NEXT_DUE).fetchone()[0]
+
+def _db_fetch_user_reminders(user_id: str) -> list:
+    """Fetch all reminders for a user, newest first, as API-ready dicts"""
+    with DB_LOCK:
+        cursor = DB_CONN.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(SQL_USER_REMINDERS, (user_id,))
+        # Iterate the cursor directly rather than materializing fetchall() first.
+        # created_at is stored to the second, so it is returned without microseconds
+        return [
+            {
+                "id": r["id"],
+                "message": r["message"],
+                "reminder_date": format_reminder_date(r["reminder_date"]),
+                "created_at": datetime.fromtimestamp(r["created_at"]).isoformat(),
+                "sent": bool(r["sent"])
+            }
+            for r in cursor
+        ]
 
 # Pydantic models
 class ReminderRequest(BaseModel):
@@ -58,10 +228,27 @@ class TelegramWebhook(BaseModel):
 # Telegram Bot Configuration
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+# Publicly reachable HTTPS base URL Telegram delivers webhook updates to
+PUBLIC_URL = os.getenv("PUBLIC_URL", "").rstrip("/")
+# Shared secret Telegram sends with every webhook call so forged updates can be rejected
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
 
 # Templates
 templates = Jinja2Templates(directory="templates")
 
+def parse_reminder_date(date_str: str) -> datetime:
+    """Parse a YYYY-MM-DD HH:MM string
+    
+    Zero-padded input takes a fixed-width fast path; anything else falls back to
+    strptime so exactly the same strings are accepted as before.
+    """
+    if (len(date_str) == 16 and date_str[4] == "-" and date_str[7] == "-"
+            and date_str[10] == " " and date_str[13] == ":"):
+        fields = (date_str[0:4], date_str[5:7], date_str[8:10], date_str[11:13], date_str[14:16])
+        if all(field.isascii() and field.isdigit() for field in fields):
+            return datetime(*map(int, fields))
+    return datetime.strptime(date_str, "%Y-%m-%d %H:%M")
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Serve the web interface"""
@@ -72,28 +259,21 @@ async def set_reminder(reminder: ReminderRequest):
     """Create a new reminder"""
     try:
         # Parse and validate the date
-        reminder_datetime = datetime.strptime(reminder.reminder_date, "%Y-%m-%d %H:%M")
+        reminder_datetime = parse_reminder_date(reminder.reminder_date)
         
         # Check if the date is in the future
         if reminder_datetime <= datetime.now():
             raise HTTPException(status_code=400, detail="Reminder date must be in the future")
         
         # Store in database
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO reminders (user_id, chat_id, message, reminder_date, created_at, sent)
-            VALUES (?, ?, ?, ?, ?, 0)
-        """, (
+        reminder_id = await asyncio.to_thread(
+            _db_insert_reminder,
             reminder.user_id,
             reminder.chat_id,
             reminder.message,
-            reminder.reminder_date,
-            datetime.now().isoformat()
-        ))
-        conn.commit()
-        reminder_id = cursor.lastrowid
-        conn.close()
+            int(reminder_datetime.timestamp())
+        )
+        app.state.next_wake.set()
         
         logger.info(f"Reminder created: ID={reminder_id}, Date={reminder.reminder_date}")
         
@@ -109,20 +289,30 @@ async def set_reminder(reminder: ReminderRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/webhook")
-async def telegram_webhook(webhook: dict):
+async def telegram_webhook(
+    webhook: TelegramWebhook,
+    x_telegram_bot_api_secret_token: Optional[str] = Header(None)
+):
     """Handle Telegram webhook updates"""
+    # Compare bytes: compare_digest raises TypeError on non-ASCII str input
+    if not TELEGRAM_WEBHOOK_SECRET or not secrets.compare_digest(
+        (x_telegram_bot_api_secret_token or "").encode(), TELEGRAM_WEBHOOK_SECRET.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Invalid webhook secret token")
+    
     # Convert webhook to update format
-    update = {"update_id": webhook.get("update_id", 0), "message": webhook.get("message")}
-    await handle_telegram_update(update)
+    update = {"update_id": webhook.update_id, "message": webhook.message}
+    row = await handle_telegram_update(update)
+    if row:
+        await save_reminders([row])
     return {"ok": True}
 
-async def send_telegram_message(chat_id: str, text: str, reply_markup: Optional[dict] = None):
-    """Send a message via Telegram Bot API"""
+async def send_telegram_message(chat_id: str, text: str, reply_markup: Optional[dict] = None) -> bool:
+    """Send a message via Telegram Bot API, returning whether Telegram accepted it"""
     if not TELEGRAM_BOT_TOKEN:
         logger.warning("TELEGRAM_BOT_TOKEN not set, cannot send message")
-        return
+        return False
     
-    url = f"{TELEGRAM_API_URL}/sendMessage"
     payload = {
         "chat_id": chat_id,
         "text": text,
@@ -133,91 +323,226 @@ async def send_telegram_message(chat_id: str, text: str, reply_markup: Optional[
         payload["reply_markup"] = reply_markup
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, timeout=10.0)
-            response.raise_for_status()
-            result = response.json()
-            if not result.get("ok"):
-                logger.error(f"Telegram API error: {result.get('description', 'Unknown error')}")
+        response = await app.state.http.post("/sendMessage", json=payload)
+        response.raise_for_status()
+        result = response.json()
+        if not result.get("ok"):
+            logger.error(f"Telegram API error: {result.get('description', 'Unknown error')}")
+            return False
+        return True
     except httpx.HTTPStatusError as e:
         error_detail = e.response.text if e.response else str(e)
         logger.error(f"HTTP error sending Telegram message: {error_detail}")
     except Exception as e:
         logger.error(f"Error sending Telegram message: {e}")
+    return False
+
+async def send_reminder_message(reminder_id: int, chat_id: str, text: str) -> bool:
+    """Send a reminder within Telegram's rate limit, returning whether it was accepted"""
+    async with app.state.send_limit:
+        started = time.monotonic()
+        sent = await send_telegram_message(chat_id, text)
+        if sent:
+            # Record the delivery right away so a shutdown mid fan-out can still mark it
+            unmarked_ids.add(reminder_id)
+            logger.info(f"Reminder sent: ID={reminder_id}, Chat={chat_id}")
+        else:
+            logger.error(f"Reminder not sent, will retry: ID={reminder_id}, Chat={chat_id}")
+        # Hold the slot for a full second so no more than 30 sends start per second
+        await asyncio.sleep(max(0, 1 - (time.monotonic() - started)))
+    return sent
+
+async def send_chat_reminders(chat_messages: list) -> bool:
+    """Send one chat's reminders one after another, returning whether all were accepted"""
+    all_sent = True
+    for reminder_id, chat_id, text in chat_messages:
+        if not await send_reminder_message(reminder_id, chat_id, text):
+            all_sent = False
+    return all_sent
+
+async def flush_sent_ids():
+    """Mark delivered reminders as sent, keeping them for a retry if that fails"""
+    global next_mark_retry
+    if not unmarked_ids:
+        return
+    reminder_ids = list(unmarked_ids)
+    try:
+        await asyncio.to_thread(_db_mark_sent, reminder_ids)
+    except Exception as e:
+        logger.error(f"Error marking reminders as sent: {e}")
+        next_mark_retry = time.time() + MARK_RETRY_SECONDS
+        return
+    unmarked_ids.difference_update(reminder_ids)
 
 async def check_and_send_reminders():
     """Check for due reminders and send them"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    global next_send_retry
+    # Retry any earlier failed update first so those reminders aren't sent twice
+    await flush_sent_ids()
     
-    now = datetime.now().strftime("%Y-%m-%d %H:%M")
-    cursor.execute("""
-        SELECT id, user_id, chat_id, message, reminder_date
-        FROM reminders
-        WHERE sent = 0 AND reminder_date <= ?
-    """, (now,))
+    now = int(time.time())
+    reminders = await asyncio.to_thread(_db_fetch_due, now)
+    reminders = [reminder for reminder in reminders if reminder[0] not in unmarked_ids]
     
-    reminders = cursor.fetchall()
+    # Format every reminder up front, then send to different chats concurrently
+    # over the shared client; Telegram also limits each chat to about one message
+    # per second, so a chat's own reminders go out in order
+    messages_by_chat = {}
+    for reminder_id, _user_id, chat_id, message, reminder_date in reminders:
+        text = f"🔔 Reminder!\n\n{message}\n\nDate: {format_reminder_date(reminder_date)}"
+        messages_by_chat.setdefault(chat_id, []).append((reminder_id, chat_id, text))
+    results = await asyncio.gather(
+        *(send_chat_reminders(chat_messages) for chat_messages in messages_by_chat.values())
+    )
     
-    for reminder_id, user_id, chat_id, message, reminder_date in reminders:
-        try:
-            reminder_text = f"🔔 Reminder!\n\n{message}\n\nDate: {reminder_date}"
-            await send_telegram_message(chat_id, reminder_text)
-            
-            # Mark as sent
-            cursor.execute("UPDATE reminders SET sent = 1 WHERE id = ?", (reminder_id,))
-            conn.commit()
-            
-            logger.info(f"Reminder sent: ID={reminder_id}, Chat={chat_id}")
-        except Exception as e:
-            logger.error(f"Error sending reminder {reminder_id}: {e}")
+    # Unsent reminders stay due; retry them after a pause rather than at once
+    if not all(results):
+        next_send_retry = time.time() + SEND_RETRY_SECONDS
     
-    conn.close()
+    # Mark all sent reminders in a single transaction
+    await flush_sent_ids()
+
+async def archive_old_reminders():
+    """Archive sent reminders older than the retention period"""
+    cutoff = int(time.time()) - REMINDER_RETENTION_SECONDS
+    try:
+        archived = await asyncio.to_thread(_db_archive_sent, cutoff)
+        if archived:
+            logger.info(f"Archived {archived} old reminders")
+    except Exception as e:
+        logger.error(f"Error archiving reminders: {e}")
 
 async def scheduler():
-    """Background scheduler to check reminders"""
-    while True:
-        await asyncio.sleep(60)  # Check every minute
-        await check_and_send_reminders()
+    """Background scheduler that sleeps until the next reminder is due"""
+    next_archive = time.time()
+    try:
+        while True:
+            app.state.next_wake.clear()
+            if time.time() >= next_archive:
+                await archive_old_reminders()
+                next_archive = time.time() + ARCHIVE_INTERVAL_SECONDS
+            next_due = await asyncio.to_thread(_db_next_due)
+            
+            # Sleep until the earliest pending reminder or the next archive run,
+            # or until a new reminder is added
+            now = time.time()
+            delay = next_archive - now
+            if unmarked_ids:
+                # Unmarked reminders keep next_due in the past; wait for the retry
+                # deadline instead of spinning
+                delay = min(delay, next_mark_retry - now)
+            elif next_due is not None:
+                delay = min(delay, max(next_due, next_send_retry) - now)
+            delay = max(0, delay)
+            
+            try:
+                await asyncio.wait_for(app.state.next_wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                await check_and_send_reminders()
+    except asyncio.CancelledError:
+        # Mark reminders delivered before the cancel so they aren't resent on the
+        # next start; done synchronously since the task can no longer await
+        if unmarked_ids:
+            try:
+                _db_mark_sent(list(unmarked_ids))
+                unmarked_ids.clear()
+            except Exception as e:
+                logger.error(f"Error marking reminders as sent on shutdown: {e}")
+        logger.info("Reminder scheduler stopped")
+        raise
 
-async def telegram_polling():
-    """Poll Telegram for updates"""
+async def register_webhook():
+    """Point Telegram at this app's webhook endpoint"""
     if not TELEGRAM_BOT_TOKEN:
-        logger.warning("TELEGRAM_BOT_TOKEN not set, skipping polling")
+        logger.warning("TELEGRAM_BOT_TOKEN not set, skipping webhook registration")
+        return
+    if not PUBLIC_URL:
+        logger.warning("PUBLIC_URL not set, skipping webhook registration")
+        return
+    if not TELEGRAM_WEBHOOK_SECRET:
+        logger.warning("TELEGRAM_WEBHOOK_SECRET not set, skipping webhook registration")
         return
     
-    logger.info(f"Starting Telegram polling with token: {TELEGRAM_BOT_TOKEN[:10]}...")
-    offset = 0
-    while True:
-        try:
-            url = f"{TELEGRAM_API_URL}/getUpdates"
-            params = {"offset": offset, "timeout": 10}
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params, timeout=15.0)
-                response.raise_for_status()
-                data = response.json()
-            
-            if not data.get("ok"):
-                logger.error(f"Telegram API error: {data.get('description', 'Unknown error')}")
-                await asyncio.sleep(5)
-                continue
-            
-            if data.get("result"):
-                for update in data["result"]:
-                    offset = update["update_id"] + 1
-                    await handle_telegram_update(update)
-        except httpx.HTTPStatusError as e:
-            error_detail = e.response.text if e.response else str(e)
-            logger.error(f"HTTP error in polling: {error_detail}")
-            await asyncio.sleep(5)
-        except Exception as e:
-            logger.error(f"Error in polling: {e}")
-            await asyncio.sleep(5)
-
-async def handle_telegram_update(update: dict):
-    """Handle a Telegram update"""
-    if "message" not in update:
+    try:
+        response = await app.state.http.post("/setWebhook", json={
+            "url": f"{PUBLIC_URL}/api/webhook",
+            "secret_token": TELEGRAM_WEBHOOK_SECRET
+        })
+        response.raise_for_status()
+        result = response.json()
+        if result.get("ok"):
+            logger.info(f"Telegram webhook set to {PUBLIC_URL}/api/webhook")
+        else:
+            logger.error(f"Telegram API error: {result.get('description', 'Unknown error')}")
+    except httpx.HTTPStatusError as e:
+        error_detail = e.response.text if e.response else str(e)
+        logger.error(f"HTTP error setting Telegram webhook: {error_detail}")
+    except Exception as e:
+        logger.error(f"Error setting Telegram webhook: {e}")
+
+async def save_reminders(rows: list):
+    """Store reminders parsed from /remind commands and confirm them to their chats"""
+    await asyncio.to_thread(_db_insert_reminders, rows)
+    app.state.next_wake.set()
+    
+    for user_id, chat_id, reminder_message, reminder_ts in rows:
+        date_str = format_reminder_date(reminder_ts)
+        await send_telegram_message(
+            chat_id,
+            f"✅ Reminder set for {date_str}!\n\nMessage: {reminder_message}"
+        )
+
+async def handle_start(chat_id: int, user_id: int, rest: str):
+    """Handle /start command"""
+    welcome_message = (
+        "👋 Welcome to Reminder Bot!\n\n"
+        "I can help you set reminders. Here's how:\n"
+        "1. Use the web interface: /web\n"
+        "2. Or send me a message in format:\n"
+        "   /remind YYYY-MM-DD HH:MM Your reminder message\n\n"
+        "Example: /remind 2024-12-25 10:00 Merry Christmas!\n\n"
+        "💡 Tip: Use /chatid to get your Chat ID for the web interface"
+    )
+    await send_telegram_message(str(chat_id), welcome_message)
+
+async def handle_chatid(chat_id: int, user_id: int, rest: str):
+    """Handle /chatid command"""
+    chat_id_message = (
+        f"📱 Your Chat ID: `{chat_id}`\n\n"
+        f"👤 Your User ID: `{user_id}`\n\n"
+        "Copy your Chat ID and use it in the web interface at:\n"
+        "http://localhost:8000"
+    )
+    await send_telegram_message(str(chat_id), chat_id_message)
+
+async def handle_web(chat_id: int, user_id: int, rest: str):
+    """Handle /web command - send web app link"""
+    web_app_url = os.getenv("WEB_APP_URL", "http://localhost:8000")
+    keyboard = {
+        "inline_keyboard": [[
+            {
+                "text": "Open Reminder App",
+                "web_app": {"url": web_app_url}
+            }
+        ]]
+    }
+    await send_telegram_message(str(chat_id), "Click the button below to open the reminder app:", keyboard)
+
+# Commands that only send a reply; /remind is handled separately since it
+# returns a row for the caller to store
+HANDLERS: Dict[str, Callable[[int, int, str], Awaitable[None]]] = {
+    "/start": handle_start,
+    "/chatid": handle_chatid,
+    "/web": handle_web,
+}
+
+async def handle_telegram_update(update: dict) -> Optional[tuple]:
+    """Handle a Telegram update
+    
+    A valid /remind command is not stored here; its (user_id, chat_id, message,
+    reminder_ts) row is returned so the caller can batch the insert.
+    """
+    if not update.get("message"):
         return
     
     message = update["message"]
@@ -228,73 +553,28 @@ async def handle_telegram_update(update: dict):
     if not chat_id or not user_id:
         return
     
-    # Handle /start command
-    if text == "/start":
-        welcome_message = (
-            "👋 Welcome to Reminder Bot!\n\n"
-            "I can help you set reminders. Here's how:\n"
-            "1. Use the web interface: /web\n"
-            "2. Or send me a message in format:\n"
-            "   /remind YYYY-MM-DD HH:MM Your reminder message\n\n"
-            "Example: /remind 2024-12-25 10:00 Merry Christmas!\n\n"
-            "💡 Tip: Use /chatid to get your Chat ID for the web interface"
-        )
-        await send_telegram_message(str(chat_id), welcome_message)
-    
-    # Handle /chatid command
-    elif text == "/chatid":
-        chat_id_message = (
-            f"📱 Your Chat ID: `{chat_id}`\n\n"
-            f"👤 Your User ID: `{user_id}`\n\n"
-            "Copy your Chat ID and use it in the web interface at:\n"
-            "http://localhost:8000"
-        )
-        await send_telegram_message(str(chat_id), chat_id_message)
-    
-    # Handle /web command - send web app link
-    elif text == "/web":
-        web_app_url = os.getenv("WEB_APP_URL", "http://localhost:8000")
-        keyboard = {
-            "inline_keyboard": [[
-                {
-                    "text": "Open Reminder App",
-                    "web_app": {"url": web_app_url}
-                }
-            ]]
-        }
-        await send_telegram_message(str(chat_id), "Click the button below to open the reminder app:", keyboard)
+    cmd, _, rest = text.partition(" ")
+    handler = HANDLERS.get(cmd)
+    if handler:
+        await handler(chat_id, user_id, rest)
     
     # Handle /remind command
-    elif text.startswith("/remind"):
+    elif cmd == "/remind":
         parts = text.split(" ", 3)
         if len(parts) >= 4:
             date_str = f"{parts[1]} {parts[2]}"
             reminder_message = parts[3]
             
             try:
-                reminder_datetime = datetime.strptime(date_str, "%Y-%m-%d %H:%M")
+                reminder_datetime = parse_reminder_date(date_str)
                 if reminder_datetime <= datetime.now():
                     await send_telegram_message(str(chat_id), "❌ Reminder date must be in the future!")
                 else:
-                    # Store reminder
-                    conn = sqlite3.connect(DB_NAME)
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        INSERT INTO reminders (user_id, chat_id, message, reminder_date, created_at, sent)
-                        VALUES (?, ?, ?, ?, ?, 0)
-                    """, (
+                    return (
                         str(user_id),
                         str(chat_id),
                         reminder_message,
-                        date_str,
-                        datetime.now().isoformat()
-                    ))
-                    conn.commit()
-                    conn.close()
-                    
-                    await send_telegram_message(
-                        str(chat_id),
-                        f"✅ Reminder set for {date_str}!\n\nMessage: {reminder_message}"
+                        int(reminder_datetime.timestamp())
                     )
             except ValueError:
                 await send_telegram_message(
@@ -307,38 +587,55 @@ async def handle_telegram_update(update: dict):
                 "❌ Invalid format. Use: /remind YYYY-MM-DD HH:MM Your message"
             )
 
+def log_task_exception(task: asyncio.Task):
+    """Log a background task that stopped with an error"""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task {task.get_name()} crashed", exc_info=task.exception())
+
 @app.on_event("startup")
 async def startup_event():
-    """Start the scheduler and polling on app startup"""
+    """Start the scheduler and register the Telegram webhook on app startup"""
+    # Opened here rather than at import so it can be reopened after a shutdown
+    init_db()
+    # One keep-alive client for all Telegram API calls
+    app.state.http = httpx.AsyncClient(
+        base_url=TELEGRAM_API_URL,
+        http2=True,
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=20)
+    )
+    # Created here rather than at import so they belong to the server's event loop.
+    # next_wake is set whenever a reminder is inserted so the scheduler re-plans
+    app.state.next_wake = asyncio.Event()
+    # Telegram allows about 30 messages per second; each send holds a slot for a second
+    app.state.send_limit = asyncio.Semaphore(30)
     logger.info("Starting reminder scheduler...")
-    asyncio.create_task(scheduler())
-    logger.info("Starting Telegram polling...")
-    asyncio.create_task(telegram_polling())
+    app.state.bg_tasks = [asyncio.create_task(scheduler(), name="scheduler")]
+    for task in app.state.bg_tasks:
+        # Tasks kept on app.state are never garbage collected, so asyncio would
+        # not report their exceptions on its own
+        task.add_done_callback(log_task_exception)
+    await register_webhook()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks, then close the shared HTTP client and database connection"""
+    for task in app.state.bg_tasks:
+        task.cancel()
+    await asyncio.gather(*app.state.bg_tasks, return_exceptions=True)
+    
+    await app.state.http.aclose()
+    if DB_CONN is not None:
+        # Taking the lock lets a write still running in a worker thread commit first
+        with DB_LOCK:
+            DB_CONN.close()
+        logger.info("Database connection closed")
 
 @app.get("/api/reminders/{user_id}")
 async def get_user_reminders(user_id: str):
     """Get all reminders for a user"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, message, reminder_date, created_at, sent
-        FROM reminders
-        WHERE user_id = ?
-        ORDER BY reminder_date DESC
-    """, (user_id,))
-    
-    reminders = []
-    for row in cursor.fetchall():
-        reminders.append({
-            "id": row[0],
-            "message": row[1],
-            "reminder_date": row[2],
-            "created_at": row[3],
-            "sent": bool(row[4])
-        })
-    
-    conn.close()
-    return {"reminders": reminders}
+    reminders = await asyncio.to_thread(_db_fetch_user_reminders, user_id)
+    return ORJSONResponse({"reminders": reminders})
 
 if __name__ == "__main__":
     import uvicorn